@@ -5,6 +5,8 @@ from enum import StrEnum
 from abc import ABCMeta, abstractmethod
 import typing
 import copy
+import operator
+import threading
 from itertools import chain
 
 log = logging.getLogger(__name__)
@@ -28,22 +30,29 @@ def registerType(type, to_sql, from_sql):
     sqlite3.register_converter(type.__name__, from_sql)
 
 
+# plain values that can skip the __sql__/__params__ probing
+scalars = frozenset((int, float, str, bytes, bool, type(None)))
+
+
 # generate sql and params for connection.execute()
 def SQL(o) -> str:
-    if hasattr(o, "__sql__"):
-        return o.__sql__()
-    if isinstance(o, (int, float)):
-        return str(o)
-    return "(?)"
+    # plain values (numbers included) are always bound as parameters so that
+    # the sql text stays stable and sqlite3's statement cache can reuse it
+    if type(o) in scalars:
+        return "(?)"
+    sql = getattr(o, "__sql__", None)
+    return "(?)" if sql is None else sql()
 
 
 def params(o) -> tuple:
     """generate flattened tuple of exactly the arguments replaced with '(?)' by SQL()."""
-    if hasattr(o, "__params__"):
-        return o.__params__()
-    if SQL(o) == "(?)":
+    # mirror SQL() without rendering anything, which for a subquery is not cheap
+    if type(o) in scalars:
         return (o,)
-    return ()
+    p = getattr(o, "__params__", None)
+    if p is not None:
+        return p()
+    return () if hasattr(o, "__sql__") else (o,)
 
 
 class DoesNotExist(Exception):
@@ -73,6 +82,8 @@ class method:
 class QueryAPI(metaclass=ABCMeta):
     """Define the API used to construct SQL queries."""
 
+    __slots__ = ()
+
     @abstractmethod
     def __pos__(self) -> "Query":
         """convert any conforming object to query."""
@@ -98,8 +109,8 @@ class QueryAPI(metaclass=ABCMeta):
         return (+self)(*columns, distinct=distinct)
 
     @method
-    def __contains__(self, __o) -> "Query":
-        """fetch rows."""
+    def __contains__(self, __o) -> bool:
+        """check if a value or row is among the results."""
         return (+self).__contains__(__o)
 
     @method
@@ -107,6 +118,11 @@ class QueryAPI(metaclass=ABCMeta):
         """specify an additional ORDER BY clause."""
         return (+self).sort(*by)
 
+    @method
+    def deep(self, *fields):
+        """fetch the rows referenced by these foreign key fields in the same query."""
+        return (+self).deep(*fields)
+
     @method
     def delete(self):
         """delete matching rows and return the number of rows deleted"""
@@ -141,7 +157,7 @@ class Query[T](QueryAPI):
     top level query operations
     * select - return iter of Model()
     * select tuple - return only selected columns as iter of Row()
-    * select deep - follow foreign keys and instantiate models
+    * select deep - follow foreign keys and instantiate models in a single query
     * get_or_create - like django's get_or_create, return Model()
     * get - return Model() or raise count exception
     * delete - delete selected rows
@@ -152,6 +168,9 @@ class Query[T](QueryAPI):
     let __curry() determine how flags are appended/extended
     """
 
+    # queries are created for every comparison, keep them small
+    __slots__ = ("__flags", "__sql", "__wsql", "__wparams", "__groups", "__params")
+
     def __init__(
         self,
         table: T,
@@ -161,6 +180,7 @@ class Query[T](QueryAPI):
         distinct=False,
         limit=None,
         offset=None,
+        deep=(),
     ):
         f = dict(
             table=table,
@@ -170,14 +190,21 @@ class Query[T](QueryAPI):
             distinct=distinct,
             limit=limit,
             offset=offset,
+            deep=deep,
         )
-        tup = "columns", "where", "order"
-        for t in tup:
-            if not isinstance(f[t], (list, tuple)):
-                f[t] = (f[t],)
+        # clauses are kept as tuples so that __curry can extend them without aliasing
+        for t in "columns", "where", "order", "deep":
+            v = f[t]
+            if type(v) is not tuple:
+                f[t] = tuple(v) if isinstance(v, list) else (v,)
         self.__flags = f
+        self.__sql = None  # rendered lazily by __select
+        self.__wsql = None  # rendered lazily by __where, shared by select and delete
+        self.__wparams = ()  # parameters of the WHERE clause, collected by __where
+        self.__groups = None  # collected lazily by __group, shared by select and params
+        self.__params = None  # collected lazily by __params__
 
-    def __curry(self, extend=("where", "columns", "order"), **flags) -> "Query":
+    def __curry(self, extend=("where", "columns", "order", "deep"), **flags) -> "Query":
         """Used internally to add clauses and return a new Query object."""
         out = self.__flags.copy()
         for k, v in flags.items():
@@ -193,31 +220,55 @@ class Query[T](QueryAPI):
     def __table(self):
         return SQL(self.__flags["table"])
 
+    def __joins(self):
+        # related rows are only fetched alongside whole rows, not explicit columns
+        if self.__flags["columns"]:
+            return ""
+        return "".join(
+            f" LEFT JOIN {SQL(f.__type__())} AS _{i} ON {SQL(f)} = _{i}.id"
+            for i, f in enumerate(self.__flags["deep"])
+        )
+
     def __distinct(self):
         return " DISTINCT" if self.__flags["distinct"] else ""
 
     def __columns(self):
         c = self.__flags["columns"]
-        return ", ".join(map(SQL, c)) if c else "*"
+        if c:
+            return ", ".join(map(SQL, c))
+        if self.__flags["deep"]:
+            joined = (f"_{i}.*" for i in range(len(self.__flags["deep"])))
+            return ", ".join((f"{self.__table()}.*", *joined))
+        return "*"
 
     def __where(self):
-        w = self.__flags["where"]
-        return f" WHERE {' AND '.join(SQL(wc) for wc in w)}" if w else ""
+        if self.__wsql is None:
+            w = self.__flags["where"]
+            self.__wsql = f" WHERE {' AND '.join(map(SQL, w))}" if w else ""
+            self.__wparams = tuple(chain.from_iterable(map(params, w)))
+        return self.__wsql
+
+    @staticmethod
+    def __term(o):
+        # ORDER BY and GROUP BY read an integer as a column number, so it can't be bound
+        return str(o) if type(o) is int else SQL(o)
 
     def __order(self):
         o = self.__flags["order"]
-        return f" ORDER BY {', '.join(SQL(oc) for oc in o)}" if o else ""
+        return f" ORDER BY {', '.join(map(self.__term, o))}" if o else ""
 
     def __group(self):
-        return (
-            c.by
-            for c in self.__flags["columns"]
-            if isinstance(c, Agg) and c.by is not None
-        )
+        if self.__groups is None:
+            self.__groups = tuple(
+                c.by
+                for c in self.__flags["columns"]
+                if type(c) is Agg and c.by is not None
+            )
+        return self.__groups
 
     def __sgroup(self):
-        groups = tuple(self.__group())
-        return f" GROUP BY {','.join(map(SQL, groups))}" if groups else ""
+        groups = self.__group()
+        return f" GROUP BY {','.join(map(self.__term, groups))}" if groups else ""
 
     def __limit(self):
         l = self.__flags["limit"]
@@ -225,43 +276,76 @@ class Query[T](QueryAPI):
         if l is None and o is None:
             return ""
         if o is None:
-            return f" LIMIT {SQL(l)}"
+            return f" LIMIT {int(l)}"
         if l is None:
-            return f" LIMIT {SQL(o)}, -1"
-        return f" LIMIT {SQL(o)}, {SQL(l)}"
+            return f" LIMIT {int(o)}, -1"
+        return f" LIMIT {int(o)}, {int(l)}"
 
     def __select(self):
-        return (
-            f"SELECT{self.__distinct()} {self.__columns()} FROM {self.__table()}"
-            f"{self.__where()}{self.__sgroup()}{self.__order()}{self.__limit()}"
-        )
+        # queries are never modified in place (see __curry), so render only once
+        if self.__sql is None:
+            self.__sql = (
+                f"SELECT{self.__distinct()} {self.__columns()} FROM {self.__table()}"
+                f"{self.__joins()}{self.__where()}{self.__sgroup()}"
+                f"{self.__order()}{self.__limit()}"
+            )
+        return self.__sql
 
     def select(self):
-        with self.__connection as c:
-            log.info(repr(self.__flags))
-            ret = c.execute(self.__select(), tuple(params(self)))
-        if len(self.__flags["columns"]) == 1:
-            return (x[0] for x in ret)
+        f = self.__flags
+        if f["columns"]:
+            factory = None
+        elif f["deep"]:
+            factory = self.__deep_factory()
+        else:
+            factory = f["table"]._from_row
+        with Model._connection as c:
+            log.info("%r", f)  # formatted only if the message is emitted
+            ret = c.select(factory, self.__select(), self.__params__())
+        if len(f["columns"]) == 1:
+            return map(operator.itemgetter(0), ret)
         return ret
 
+    def __deep_factory(self):
+        """split each joined row into the selected model and the models it references."""
+        table = self.__flags["table"]
+        joins, start = [], len(table.__fields__)
+        for f in self.__flags["deep"]:
+            model = f.__type__()
+            end = start + len(model.__fields__)
+            joins.append(
+                (str(f), model, start, end, start + model.__fields__.index("id"))
+            )
+            start = end
+
+        def factory(cursor, row):
+            obj = table._from_row(cursor, row)
+            for name, model, start, end, id in joins:
+                if row[id] is not None:
+                    setattr(obj, name, model._from_row(cursor, row[start:end]))
+            return obj
+
+        return factory
+
     ## PROPERTIES
     def __sql__(self):
         return f"({self.__select()})"
 
     def __params__(self):
         # the order of parameters should match the order in __select
-        return chain.from_iterable(
-            map(
-                params,
-                chain(self.__flags["columns"], self.__group(), self.__flags["where"]),
+        if self.__params is None:
+            f = self.__flags
+            self.__where()
+            self.__params = (
+                *chain.from_iterable(map(params, f["columns"])),
+                *self.__wparams,
+                *chain.from_iterable(
+                    params(o)
+                    for o in chain(self.__group(), f["order"])
+                    if type(o) is not int
+                ),
             )
-        )
-
-    @property
-    def __connection(self):
-        if len(self.__flags["columns"]):
-            return Model._connection
-        return self.__flags["table"]._connection
+        return self.__params
 
     ## API
     def __pos__(self):
@@ -271,7 +355,18 @@ class Query[T](QueryAPI):
         return iter(self.select())
 
     def __len__(self) -> int:
-        return self.__curry(columns=Agg("COUNT"), extend="where").get()
+        # the count doesn't depend on the order or on joined rows, so leave them out
+        # and read the single result row straight off the cursor instead of going through get()
+        f = self.__flags
+        if f["limit"] is None and f["offset"] is None:
+            q = self.__curry(columns=Agg("COUNT"), order=(), deep=(), extend="where")
+            sql, p = q.__select(), q.__params__()
+        else:
+            # a slice limits the rows, not the count, so count the sliced query
+            q = self.__curry(order=(), deep=(), extend=())
+            sql, p = f"SELECT COUNT(*) FROM {SQL(q)}", q.__params__()
+        with Model._connection as c:
+            return c.execute(sql, p).fetchone()[0]
 
     def __repr__(self):
         return f"Query{self.__sql__()}"
@@ -298,17 +393,41 @@ class Query[T](QueryAPI):
             columns=columns, distinct=self.__flags["distinct"] or distinct
         )
 
-    def __contains__(self, __o):
-        return Query(self.__table, where=Filter(__o, cmp.in_, self))
+    def __contains__(self, __o) -> bool:
+        columns, table = self.__flags["columns"], self.__flags["table"]
+        if len(columns) > 1:
+            raise TypeError("membership can only be tested against a single column")
+        if not columns:
+            # whole rows are matched by id, and like __eq__ only rows of the exact same model
+            if isinstance(__o, Model) and type(__o) is not table:
+                return False
+            columns = (table.id,)
+        # sqlite stops scanning at the first match
+        q = self.__curry(columns=columns, extend=())
+        sql = f"SELECT {SQL(__o)} IN {SQL(q)}"
+        with Model._connection as c:
+            return bool(c.execute(sql, (*params(__o), *params(q))).fetchone()[0])
 
     def delete(self) -> int:
-        sql = f"DELETE FROM {self.__table()} {self.__where()}"
-        with self.__connection as c:
-            return c.execute(sql, tuple(params(self))).rowcount
+        sql = f"DELETE FROM {self.__table()}{self.__where()}"
+        with Model._connection as c:
+            return c.execute(sql, self.__wparams).rowcount
 
     def sort(self, *by):
         return self.__curry(order=by)
 
+    def deep(self, *fields):
+        """Fetch the models referenced by these foreign key fields with a join."""
+        table = self.__flags["table"]
+        for f in fields:
+            if not (
+                isinstance(f, Field)
+                and issubclass(f.__type__(), Model)
+                and f.__table__() is table
+            ):
+                raise TypeError(f"{f!r} is not a foreign key of {SQL(table)}")
+        return self.__curry(deep=fields)
+
     def first(self) -> T:
         first = next(iter(self[:1]), None)
         if first is None:
@@ -390,6 +509,16 @@ class Reference:
     """this is needed for type checking."""
 
 
+# column types of python types that sqlite handles natively, others use the type's name
+sqltypes = {
+    type(None): "NULL",
+    int: "INTEGER",
+    float: "REAL",
+    str: "TEXT",
+    bytes: "BLOB",
+}
+
+
 class Field[T, F](QueryAPI):
     def __init__(
         self,
@@ -403,24 +532,22 @@ class Field[T, F](QueryAPI):
         store: bool = False,
     ):
 
+        self.__reference = issubclass(typ, Reference)
         typename = (
             f"INTEGER REFERENCES {SQL(typ)}"
-            if issubclass(typ, Reference)
-            else {
-                type(None): "NULL",
-                int: "INTEGER",
-                float: "REAL",
-                str: "TEXT",
-                bytes: "BLOB",
-            }.get(typ, typ.__name__)
+            if self.__reference
+            else sqltypes.get(typ, typ.__name__)
         )
         self.__name = None
         self.__type = typ
 
         self.__default = default
-        default_prep = sqlite3.adapters.get(
-            (type(default), sqlite3.PrepareProtocol), lambda x: x
-        )(default)
+        default_prep = default
+        if default is not None:
+            # render the default the way sqlite3 would store it
+            adapt = sqlite3.adapters.get((type(default), sqlite3.PrepareProtocol))
+            if adapt is not None:
+                default_prep = adapt(default)
 
         self.__create = " ".join(
             value
@@ -442,21 +569,34 @@ class Field[T, F](QueryAPI):
             self.__create = f"{name} {self.__create}"
         self.__table = owner
         self.__name = name
+        self.__attr = f"__{name}"  # where instances store the value
+        # a column always renders the same way, so don't recurse through SQL() each time
+        self.__sql = f"{SQL(owner)}.{name}"
 
     def __get__(self, obj, t=None) -> "Field[T,F]" | F:
         if obj is None:
             return self  # called on type
 
         # called on instance
-        name = f"__{self.__name}"
+        name = self.__attr
         v = getattr(obj, name, self.__default)
-        if issubclass(self.__type, Model) and isinstance(v, int):
-            v = (self.__type.id == v).get()
+        # foreign keys are stored as the row id until first accessed
+        if self.__reference and type(v) is int:
+            t = self.__type
+            v = t._connection.select(t._from_row, t._select_sql, (v,)).fetchone()
+            if v is None:
+                raise DoesNotExist
             setattr(obj, name, v)
         return v
 
     def __set__(self, obj, value):
-        return setattr(obj, f"__{self.__name}", value)
+        return setattr(obj, self.__attr, value)
+
+    def __copy__(self):
+        # model_meta copies every inherited field, skip copy's generic __reduce_ex__ path
+        new = object.__new__(type(self))
+        new.__dict__.update(self.__dict__)
+        return new
 
     def __conflict(self, v, prefix):
         if not v or v == do.nothing:
@@ -466,37 +606,37 @@ class Field[T, F](QueryAPI):
         return True, prefix
 
     def __eq__(self, __o: object) -> Query[T]:
-        return Query(self.__table, where=Filter(self, cmp.eq, __o))
+        return Query(self.__table, where=(Filter(self, cmp.eq, __o),))
 
     def __lt__(self, __o: object) -> Query[T]:
-        return Query(self.__table, where=Filter(self, cmp.lt, __o))
+        return Query(self.__table, where=(Filter(self, cmp.lt, __o),))
 
     def __gt__(self, __o: object) -> Query[T]:
-        return Query(self.__table, where=Filter(self, cmp.gt, __o))
+        return Query(self.__table, where=(Filter(self, cmp.gt, __o),))
 
     def __ge__(self, __o: object) -> Query[T]:
-        return Query(self.__table, where=Filter(self, cmp.ge, __o))
+        return Query(self.__table, where=(Filter(self, cmp.ge, __o),))
 
     def __le__(self, __o: object) -> Query[T]:
-        return Query(self.__table, where=Filter(self, cmp.le, __o))
+        return Query(self.__table, where=(Filter(self, cmp.le, __o),))
 
     def __ne__(self, __o: object) -> Query[T]:
-        return Query(self.__table, where=Filter(self, cmp.ne, __o))
+        return Query(self.__table, where=(Filter(self, cmp.ne, __o),))
 
     def __pos__(self) -> Query[T]:
         return Query(self.__table, columns=self)
 
     def __and__(self, __o) -> Query[T]:
-        return Query(self.__table, where=Filter(self, cmp.in_, +__o))
+        return Query(self.__table, where=(Filter(self, cmp.in_, +__o),))
 
     def __str__(self):
         return self.__name
 
     def __repr__(self):
-        return f"{SQL(self.__table)}.{self.__name}"
+        return self.__sql
 
     def __sql__(self):
-        return f"{SQL(self.__table)}.{self.__name}"
+        return self.__sql
 
     def __params__(self):
         return ()
@@ -509,6 +649,12 @@ class Field[T, F](QueryAPI):
     def __default__(self) -> F:
         return self.__default
 
+    def __type__(self) -> type[F]:
+        return self.__type
+
+    def __table__(self) -> T:
+        return self.__table
+
     ## AGGREGATIONS
 
     def avg(self, by=None):
@@ -547,26 +693,69 @@ class Agg:
 
 
 class Connection(sqlite3.Connection):
-    def logexec(self, f, args):
-        try:
-            return f(*args)
-        except Exception as e:
-            query, *params = args
-            log.error(
-                f"Failed to execute query {query!r} with parameters {params[0]!r}"
-                if params
-                else f"Failed to execute query {query!r}"
-            )
-            raise e
+    # nested `with connection:` blocks join the outermost transaction, so that
+    # save()/bulk_save() can be batched together and commit only once
+    depth = 0
+
+    def __enter__(self):
+        self.depth += 1
+        return super().__enter__()
+
+    def __exit__(self, *exc):
+        self.depth -= 1
+        if self.depth:
+            return False
+        return super().__exit__(*exc)
+
+    # the happy path calls straight into sqlite3, only failures pay for logging
+    @staticmethod
+    def logerror(query, *params):
+        log.error(
+            f"Failed to execute query {query!r} with parameters {params[0]!r}"
+            if params
+            else f"Failed to execute query {query!r}"
+        )
 
     def execute(self, *args):
-        return self.logexec(super().execute, args)
+        try:
+            return sqlite3.Connection.execute(self, *args)
+        except Exception:
+            self.logerror(*args)
+            raise
 
     def executemany(self, *args):
-        return self.logexec(super().executemany, args)
+        try:
+            return sqlite3.Connection.executemany(self, *args)
+        except Exception:
+            self.logerror(*args)
+            raise
 
     def executescript(self, *args):
-        return self.logexec(super().executescript, args)
+        try:
+            return sqlite3.Connection.executescript(self, *args)
+        except Exception:
+            self.logerror(*args)
+            raise
+
+    def select(self, row_factory, *args):
+        """Execute a query on a new cursor that builds its rows with row_factory."""
+        cur = self.cursor()
+        cur.row_factory = row_factory
+        try:
+            return cur.execute(*args)
+        except Exception:
+            self.logerror(*args)
+            raise
+
+
+class local_connection(threading.local):
+    """Give each thread its own connection, opened on first use."""
+
+    def __init__(self, connect):
+        self.connection = connect()
+
+    def __get__(self, obj, type=None) -> Connection:
+        return self.connection
 
 
 class model_meta(QueryAPI, ABCMeta):
@@ -584,9 +773,46 @@ class model_meta(QueryAPI, ABCMeta):
                     if k not in dict and isinstance(v, Field)
                 }
             )
-        dict["__fields__"] = tuple(k for k, v in dict.items() if isinstance(v, Field))
+        fields = dict["__fields__"] = tuple(
+            k for k, v in dict.items() if isinstance(v, Field)
+        )
 
-        return super().__new__(cls, name, bases, dict)
+        model = super().__new__(cls, name, bases, dict)
+        # the statements used to write rows only depend on the fields, so render them once
+        # values are bound by position, in the order of __fields__
+        values = f"VALUES ({', '.join('?' for _ in fields)})"
+        model._insert_sql = f"INSERT INTO {SQL(model)} {values}"
+        model._upsert_sql = (
+            f"{model._insert_sql} ON CONFLICT(id) DO UPDATE SET "
+            f"{', '.join(f'{x}=excluded.{x}' for x in fields)}"
+        )
+        model._select_sql = f"SELECT * FROM {SQL(model)} WHERE id = ?"
+        model._delete_sql = f"DELETE FROM {SQL(model)} WHERE id = ?"
+        columns = ", ".join(getattr(model, f).__create__() for f in fields)
+        o = model.__sqlite_options__
+        if any(" ".join(x.upper().split()) == "WITHOUT ROWID" for x in o):
+            # ids are allocated by sqlite as the rowid, and migrations copy by rowid
+            model.__all__.discard(model)  # __init_subclass__ already registered it
+            raise TypeError(f"{name}: WITHOUT ROWID tables are not supported")
+        options = f" {', '.join(o)}" if o else ""
+        model._create_sql = f"CREATE TABLE {SQL(model)} ({columns}){options}"
+
+        # generate a straight-line row factory that fills the attributes Field.__set__
+        # would have, without going through __init__
+        src = "\n    ".join(
+            ["def _from_row(cursor, row):", "m = new(model)", "d = m.__dict__"]
+            + [f"d[{f'__{f}'!r}] = row[{i}]" for i, f in enumerate(fields)]
+            + ["return m"]
+        )
+        namespace = {"new": object.__new__, "model": model}
+        exec(src, namespace)
+        model._from_row = staticmethod(namespace["_from_row"])
+        # and the reverse, the values of a row in the order they are bound to the statements above
+        getter = operator.attrgetter(*fields) if fields else lambda m: ()
+        model._to_row = staticmethod(
+            (lambda m: (getter(m),)) if len(fields) == 1 else getter
+        )
+        return model
 
     def __sql__(cls):
         return cls.__name__.lower()
@@ -598,7 +824,7 @@ class model_meta(QueryAPI, ABCMeta):
         return Query(self, columns=Agg("COUNT", by=by))
 
     def __len__(self):
-        return self.count().get()
+        return len(+self)
 
     def __pos__(self):
         return Query(self)
@@ -611,8 +837,7 @@ class model_meta(QueryAPI, ABCMeta):
         return ABCMeta.__call__(self, *args, **kwargs)
 
     def __create__(cls):
-        fields = (getattr(cls, f).__create__() for f in cls.__fields__)
-        return f"CREATE TABLE {SQL(cls)} ({', '.join(fields)})"
+        return cls._create_sql
 
     def get_or_create(cls, defaults: dict | None = None, **kwargs):
         if defaults is None:
@@ -628,11 +853,62 @@ class model_meta(QueryAPI, ABCMeta):
         except ValueError:
             return cls(**defaults).save()
 
+    def bulk_save(cls, rows):
+        """
+        Save many rows in a single transaction and return them as a list.
+
+        New rows are assigned consecutive ids, which is how sqlite allocates rowids
+        to a batch of inserts made within one transaction. If a row was skipped,
+        e.g. by an ON CONFLICT IGNORE clause, the ids can't be inferred; the batch is
+        undone and the rows are inserted one at a time instead. Skipped rows keep id None.
+        """
+        rows = list(rows)
+        new = [r for r in rows if r.id is None]
+        old = [r for r in rows if r.id is not None]
+        with cls._connection as conn:
+            if new:
+                # the savepoint must not be the outermost transaction, or RELEASE would commit
+                if not conn.in_transaction:
+                    conn.execute("BEGIN")
+                conn.execute("SAVEPOINT bulk_save")
+                try:
+                    cur = conn.executemany(cls._insert_sql, map(cls._to_row, new))
+                    if cur.rowcount == len(new):
+                        last = conn.execute("SELECT last_insert_rowid()").fetchone()[0]
+                        for i, r in enumerate(new, start=last - len(new) + 1):
+                            r.id = i
+                    else:
+                        conn.execute("ROLLBACK TO bulk_save")
+                        for r in new:
+                            cur = conn.execute(cls._insert_sql, cls._to_row(r))
+                            if cur.rowcount:
+                                r.id = cur.lastrowid
+                except BaseException:
+                    # undo the partial batch even if the caller's transaction goes on
+                    conn.execute("ROLLBACK TO bulk_save")
+                    conn.execute("RELEASE bulk_save")
+                    for r in new:
+                        r.id = None
+                    raise
+                conn.execute("RELEASE bulk_save")
+            if old:
+                conn.executemany(cls._upsert_sql, map(cls._to_row, old))
+        return rows
+
 
 class Model(QueryAPI, Reference, metaclass=model_meta):
     __all__ = set()
     __fields__: tuple[str, ...] = ()
+    # table options appended to CREATE TABLE, e.g. ("STRICT",). WITHOUT ROWID is not supported
+    __sqlite_options__: tuple[str, ...] = ()
     _connection: Connection = None
+    _insert_sql: str
+    _upsert_sql: str
+    _select_sql: str
+    _delete_sql: str
+    _create_sql: str
+    _from_row: typing.Callable[[sqlite3.Cursor, tuple], "Model"]
+    _to_row: typing.Callable[["Model"], tuple]
     id = Field(int, primary=True, notnull=True)
 
     def __init__(self, **kwargs) -> None:
@@ -651,25 +927,20 @@ class Model(QueryAPI, Reference, metaclass=model_meta):
         return {f: getattr(self, f) for f in self.__fields__}
 
     def save(self):
-        t = type(self)
-        table = SQL(t)
-        if self.id is None:
-            sql = f"INSERT INTO {table} VALUES ({', '.join(f':{x}' for x in self.__fields__)}) "
-        else:
-            # TODO do foreign key recursion
-            sql = (
-                f"INSERT INTO {table} VALUES ({', '.join(f':{x}' for x in self.__fields__)}) "
-                f"ON CONFLICT(id) DO UPDATE SET {', '.join(f'{x}=:{x}' for x in self.__fields__)} WHERE id=:id"
-            )
+        # TODO do foreign key recursion
         with self._connection as conn:
-            self.id = conn.execute(sql, self.__values).lastrowid
+            if self.id is None:
+                self.id = conn.execute(self._insert_sql, self._to_row(self)).lastrowid
+            else:
+                # lastrowid isn't updated when the conflict turns into an update, keep our id
+                conn.execute(self._upsert_sql, self._to_row(self))
         return self
 
     def delete(self):
         if self.id is None:
             return self
         with self._connection as conn:
-            conn.execute(f"DELETE FROM {type(self)} WHERE id = {SQL(self.id)}")
+            conn.execute(self._delete_sql, (self.id,))
         return self
 
     def copy(self):
@@ -677,10 +948,16 @@ class Model(QueryAPI, Reference, metaclass=model_meta):
 
     def __eq__(self, __o):
         # don't use isinstance here, because we don't want subclasses, only the exact class match
-        if type(self) == type(__o):
+        if type(self) is type(__o):
             return self.id == __o.id
         return False
 
+    def __hash__(self):
+        # consistent with __eq__, so that fetched rows can be deduplicated with sets
+        if self.id is None:
+            raise TypeError("unsaved Model instances are unhashable")
+        return hash((type(self), self.id))
+
 
 class sqlite_master(Model):
     id = None  # don't include id field
@@ -691,6 +968,10 @@ class sqlite_master(Model):
     sql = Field(str)
 
 
+# number of rows copied per statement when a migration has to rebuild a table
+MIGRATION_CHUNK = 10_000
+
+
 def initialize_database(
     database="file::memory:?cache=shared",
     debug=False,
@@ -701,6 +982,8 @@ def initialize_database(
     Allow the database to be used.
 
     This should be called after all models are defined and before any calls to the database are made.
+    Extra options are passed on to sqlite3.connect(), e.g. cached_statements sizes the
+    per-connection cache of prepared statements.
     """
 
     options = {
@@ -708,29 +991,41 @@ def initialize_database(
         "detect_types": sqlite3.PARSE_DECLTYPES,
         "uri": True,
         "factory": Connection,
+        # each table issues a handful of distinct statements, keep them all prepared
+        "cached_statements": 256,
         **options,
     }
+    # connection scoped settings, applied once when each connection is opened
+    pragmas = "".join(
+        f"PRAGMA {p};"
+        for p in [
+            "FOREIGN_KEY=1",
+            "synchronous=NORMAL",
+            "temp_store=MEMORY",
+            "cache_size=-64000",
+            "mmap_size=268435456",
+        ]
+    )
 
-    def connect(model=None):
+    def connect():
         c = sqlite3.connect(**options)
-        c.execute("PRAGMA FOREIGN_KEY=1")
-        if model is not None:
-
-            def factory(_, r):
-                return model(**dict(zip(model.__fields__, r)))
-
-            factory.__name__ = f"{model}_factory"
-            c.row_factory = factory
+        c.executescript(pragmas)
         if debug:
-            c.set_trace_callback(lambda msg: log.info(f"sql {msg!r}"))
+            c.set_trace_callback(lambda msg: log.info("sql %r", msg))
         return c
 
     def execute(sql, params=()):
-        with connect() as conn:
+        with Model._connection as conn:
             return conn.execute(sql, params)
 
-    conn = connect()
-    Model._connection = connect()
+    # every model shares one connection per thread, rows are built per cursor (see Connection.select)
+    # this thread's connection is also used for the migration, so a private :memory: database works
+    Model._connection = local_connection(connect)
+    conn = Model._connection
+    if "memory" not in str(options["database"]):
+        # WAL lets readers proceed while a write is in progress.
+        # It is stored in the database file, so it only has to be set once.
+        conn.execute("PRAGMA journal_mode=WAL")
     all_models = {}
     duplicates = {}
     for model in Model.__all__:
@@ -739,7 +1034,6 @@ def initialize_database(
         # pseudo-models don't have an id
         if name.startswith("_") or model.id is None:
             continue
-        model._connection = connect(model)
         if name in all_models:
             duplicates.setdefault(name, []).append(model.__module__)
         all_models[name] = model
@@ -749,44 +1043,94 @@ def initialize_database(
             + "\n".join(f"{name:>16} in {info}" for name, info in duplicates.items())
         )
 
+    def drop_columns(model, old):
+        """
+        Migrate a table in place with ALTER TABLE DROP COLUMN, which doesn't copy any rows.
+
+        Only removals qualify: columns are read and written by position, and ADD COLUMN
+        can only append after the inherited id column. The result must match the model
+        definition exactly, otherwise the change is rolled back and False returned.
+        Runs within the migration's transaction, under a savepoint of its own.
+        """
+        name, fields = SQL(model), model.__fields__
+        if [f for f in old if f in fields] != list(fields):
+            return False
+        conn.execute("SAVEPOINT drop_columns")
+        try:
+            for f in old:
+                if f not in fields:
+                    conn.execute(f"ALTER TABLE {name} DROP COLUMN {f}")
+            sql = conn.execute(
+                "SELECT sql FROM sqlite_master WHERE name = ?", (name,)
+            ).fetchone()[0]
+        except sqlite3.OperationalError:
+            sql = None
+        ok = sql == model.__create__()
+        if not ok:
+            conn.execute("ROLLBACK TO drop_columns")
+        conn.execute("RELEASE drop_columns")
+        return ok
+
     # migrate database
     extant_tables = dict(
         (sqlite_master.type == "table")(sqlite_master.name, sqlite_master.sql)
     )
     migrations = {}
+    changed = []
     for name, model in all_models.items():
         create_stmt = model.__create__()
         if name not in extant_tables:
             conn.execute(create_stmt, params(model))
-            log.debug(f"made table: {name}")
+            log.debug("made table: %s", name)
         elif create_stmt == extant_tables[name]:
-            log.debug(f"table {name} ok")
+            log.debug("table %s ok", name)
         else:
-            old = set(
+            columns = list(
                 chain.from_iterable(
                     conn.execute(f"select name from pragma_table_info('{SQL(model)}')")
                 )
             )
+            old = set(columns)
             new = set(model.__fields__)
             shared = old.intersection(new)
             j = ", ".join
             migrations[name] = f"+({j(new - old)}) -({j(old - new)})"
-            if not allow_migrations:
-                continue
-            fields = j(shared)
-            conn.executescript(
-                f"""
-BEGIN;
-PRAGMA FOREIGN_KEY = 0;
-DROP TABLE IF EXISTS _{name};
-ALTER TABLE {name} RENAME TO _{name};
-{create_stmt};
-INSERT INTO {name}({fields}) SELECT {fields} FROM _{name};
-DROP TABLE _{name};
-PRAGMA FOREIGN_KEY = 1;
-COMMIT;
-"""
-            )
+            changed.append((model, columns, name, create_stmt, j(shared)))
+
+    if changed and allow_migrations:
+        # migrate every table in one transaction, so there is a single commit
+        # and a failure leaves the whole database as it was
+        conn.execute("PRAGMA FOREIGN_KEY = 0")
+        conn.execute("BEGIN")
+        try:
+            for model, columns, name, create_stmt, fields in changed:
+                if drop_columns(model, columns):
+                    continue
+                conn.execute(f"DROP TABLE IF EXISTS _{name}")
+                conn.execute(f"ALTER TABLE {name} RENAME TO _{name}")
+                conn.execute(create_stmt)
+                # copy MIGRATION_CHUNK rows at a time, paging by the rowids that exist
+                # so that sparse ids don't cost extra statements
+                copy_sql = (
+                    f"INSERT INTO {name}({fields}) SELECT {fields} FROM _{name} "
+                    "WHERE rowid BETWEEN ? AND ?"
+                )
+                end = (
+                    f"SELECT max(rowid) FROM (SELECT rowid FROM _{name} "
+                    "WHERE rowid >= ? ORDER BY rowid LIMIT ?)"
+                )
+                after = f"SELECT min(rowid) FROM _{name} WHERE rowid > ?"
+                start = conn.execute(f"SELECT min(rowid) FROM _{name}").fetchone()[0]
+                while start is not None:
+                    stop = conn.execute(end, (start, MIGRATION_CHUNK)).fetchone()[0]
+                    conn.execute(copy_sql, (start, stop))
+                    start = conn.execute(after, (stop,)).fetchone()[0]
+                conn.execute(f"DROP TABLE _{name}")
+        except Exception:
+            conn.rollback()
+            raise
+        conn.commit()
+        conn.execute("PRAGMA FOREIGN_KEY = 1")
 
     if migrations:
         msg = "\n".join(f"{name:>16}: {info}" for name, info in migrations.items())
@@ -794,9 +1138,9 @@ COMMIT;
             raise MigrationError("Migrations needed, but not allowed:\n" + msg)
         else:
             conn.execute("VACUUM")
-            log.info("Migrations performed:\n" + msg)
+            log.info("Migrations performed:\n%s", msg)
     else:
-        log.debug(f"database {database} ok")
+        log.debug("database %s ok", database)
     return execute
 
 